@@ -13,7 +13,10 @@ def main():
     world = webworld.world.World.from_shape(height, width, water_level)
 
     # world.visualize_height_map()
-    webworld.wiki.create_page(world)
+    with webworld.wiki.PublishQueue() as publish_queue:
+        upload = webworld.wiki.create_page(world, publish_queue=publish_queue)
+
+    upload.result()
 
 
 if __name__ == "__main__":
@@ -1,6 +1,7 @@
 import datetime
 import os
 import unittest
+import unittest.mock
 
 import matplotlib.image
 import numpy as np
@@ -36,6 +37,25 @@ class TestWikiModule(unittest.TestCase):
         contents = "This page was created by a unittest on {}.".format(datetime.datetime.now())
         webworld.wiki.send_page(title, contents, image_paths=[TEMPORARY_IMAGE_PATH], summary=summary)
 
+    def test_publish_queue(self):
+        image = np.uint8(255 * np.random.rand(TEST_IMAGE_SIZE, TEST_IMAGE_SIZE, 3))
+        sent_images = {}
+
+        def send_page(title, contents, summary="", image_paths=None, wiki_filenames=None):
+            for path, wiki_filename in zip(image_paths, wiki_filenames):
+                sent_images[wiki_filename] = matplotlib.image.imread(path)
+            if title == "Failing Page":
+                raise RuntimeError("Upload failed")
+
+        with unittest.mock.patch("webworld.wiki.send_page", side_effect=send_page):
+            with webworld.wiki.PublishQueue(max_workers=2, max_pending=1) as publish_queue:
+                upload = publish_queue.publish_page("Unittest Page", "contents", images={"image.png": image})
+                failing_upload = publish_queue.publish_page("Failing Page", "contents")
+
+        self.assertIsNone(upload.result())
+        self.assertIsInstance(failing_upload.exception(), RuntimeError)
+        self.assertEqual(sent_images["image.png"].shape[:2], image.shape[:2])
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -1,3 +1,6 @@
+import concurrent.futures
+import os
+import pickle
 import unittest
 
 import numpy as np
@@ -6,6 +9,10 @@ import webworld.log
 import webworld.world
 
 
+def give_attached_land_fraction(handle):
+    return handle.attach().give_land_fraction()
+
+
 class TestWorldModule(unittest.TestCase):
 
     @classmethod
@@ -44,6 +51,128 @@ class TestWorldModule(unittest.TestCase):
         self.assertEqual(food_map.shape, (height, width))
         self.assertEqual(world.water_level, water_level)
 
+    def test_analysis(self):
+        # Two land masses, one of which touches the border, in a sea
+        input_height_map = np.array([[0.0, 0.0, 0.0, 0.0, 0.0],
+                                     [0.0, 1.0, 1.0, 0.0, 0.0],
+                                     [0.0, 1.0, 1.0, 0.0, 1.0],
+                                     [0.0, 0.0, 0.0, 0.0, 1.0]])
+        water_level = 0.5
+        world = webworld.world.World.from_height_map(input_height_map, water_level)
+
+        self.assertAlmostEqual(world.give_water_fraction(), 14 / 20)
+        self.assertAlmostEqual(world.give_land_fraction(), 6 / 20)
+        self.assertAlmostEqual(world.give_water_fraction(water_level=2), 1)
+
+        counts, edges = world.give_height_histogram(bins=2)
+        np.testing.assert_array_equal(counts, [14, 6])
+        np.testing.assert_array_equal(edges, [0, 0.5, 1])
+
+        labels, land_mass_count = world.give_land_masses()
+        self.assertEqual(land_mass_count, 2)
+        self.assertEqual(len(np.unique(labels[1:3, 1:3])), 1)
+        self.assertEqual(len(np.unique(labels[2:4, 4])), 1)
+        self.assertNotEqual(labels[1, 1], labels[2, 4])
+        np.testing.assert_array_equal(labels[input_height_map < water_level], 0)
+
+        np.testing.assert_array_equal(world.give_coastline_mask(), input_height_map > water_level)
+
+        # Results are cached, and invalidated when the tiles change
+        self.assertIs(world.give_land_masses(), world.give_land_masses())
+        land_masses = world.give_land_masses()
+        world.give_land_masses(water_level=0.9)
+        self.assertIsNot(world.give_land_masses(), land_masses)
+        self.assertEqual(world.give_land_masses()[1], land_mass_count)
+
+        # Changing a tile in place is picked up by all maps and results
+        color_map = world.give_height_color_map()
+        world.tiles[0, 1].height = 1.0
+        self.assertEqual(world.give_map(webworld.world.Quantity.HEIGHT)[0, 1], 1.0)
+        self.assertAlmostEqual(world.give_water_fraction(), 13 / 20)
+        labels, _ = world.give_land_masses()
+        self.assertEqual(labels[0, 1], labels[1, 1])
+        self.assertTrue(world.give_coastline_mask()[0, 1])
+        self.assertFalse(np.array_equal(world.give_height_color_map()[0, 1], color_map[0, 1]))
+
+        world.tiles = webworld.world.World.tiles_from_height_map(np.ones((2, 2)))
+        self.assertEqual(world.give_land_fraction(), 1)
+        self.assertEqual(world.give_land_masses()[1], 1)
+
+    def test_land_masses(self):
+        # A spiral, whose arms only connect through later rows
+        input_height_map = np.array([[1, 1, 1, 1, 1, 1, 1, 1, 1],
+                                     [0, 0, 0, 0, 0, 0, 0, 0, 1],
+                                     [1, 1, 1, 1, 1, 1, 1, 0, 1],
+                                     [1, 0, 0, 0, 0, 0, 1, 0, 1],
+                                     [1, 0, 1, 0, 0, 0, 1, 0, 1],
+                                     [1, 0, 1, 1, 1, 1, 1, 0, 1],
+                                     [1, 0, 0, 0, 0, 0, 0, 0, 1],
+                                     [1, 1, 1, 1, 1, 1, 1, 1, 1]], dtype=float)
+        world = webworld.world.World.from_height_map(input_height_map, water_level=0.5)
+
+        labels, land_mass_count = world.give_land_masses()
+        self.assertEqual(land_mass_count, 1)
+        np.testing.assert_array_equal(labels > 0, input_height_map > 0.5)
+
+        # Rows of two land columns joined only at the bottom form a single land mass
+        input_height_map = np.zeros((4, 5))
+        input_height_map[:, 0] = 1
+        input_height_map[:, 4] = 1
+        input_height_map[3, :] = 1
+        world = webworld.world.World.from_height_map(input_height_map, water_level=0.5)
+
+        labels, land_mass_count = world.give_land_masses()
+        self.assertEqual(land_mass_count, 1)
+        np.testing.assert_array_equal(labels > 0, input_height_map > 0.5)
+
+    def test_water_level_change(self):
+        height_map = np.linspace(0, 1, 200).reshape(10, 20)
+        world = webworld.world.World.from_height_map(height_map, water_level=0.5)
+        self.assertAlmostEqual(world.give_water_fraction(), 0.5)
+
+        water_levels = (0.5, 0.3, 0.31, 0.8, 0.5)
+        color_maps = []
+        for water_level in water_levels:
+            world.water_level = water_level
+            color_maps.append(world.give_height_color_map())
+            self.assertAlmostEqual(world.give_water_fraction(), np.mean(height_map < water_level))
+
+        # Recoloring after a water level change gives the same colors as coloring from scratch, and earlier color maps
+        # are not affected by later changes
+        for water_level, color_map in zip(water_levels, color_maps):
+            new_world = webworld.world.World.from_height_map(height_map, water_level)
+            np.testing.assert_array_equal(color_map, new_world.give_height_color_map())
+
+    def test_shared_world(self):
+        height_map = np.linspace(0, 1, 200).reshape(10, 20)
+        world = webworld.world.World.from_height_map(height_map, water_level=0.5)
+
+        with world.export_shared() as shared_world:
+            # The handle refers to the data instead of containing it
+            pickled_handle = pickle.dumps(shared_world.handle)
+            self.assertLess(len(pickled_handle), height_map.nbytes)
+            handle = pickle.loads(pickled_handle)
+            attached_world = handle.attach()
+
+            np.testing.assert_array_equal(attached_world.give_map(webworld.world.Quantity.HEIGHT), height_map)
+            np.testing.assert_array_equal(attached_world.give_map(webworld.world.Quantity.FOOD),
+                                          world.give_map(webworld.world.Quantity.FOOD))
+            np.testing.assert_array_equal(attached_world.give_height_color_map(), world.give_height_color_map())
+            self.assertEqual(attached_world.tiles[2, 3].height, world.tiles[2, 3].height)
+
+            # Invalidating the cache of an attached world keeps its data
+            attached_world = handle.attach()
+            attached_world.invalidate_cache()
+            np.testing.assert_array_equal(attached_world.give_map(webworld.world.Quantity.HEIGHT), height_map)
+            np.testing.assert_array_equal(attached_world.give_water_mask(), world.give_water_mask())
+
+            with concurrent.futures.ProcessPoolExecutor(max_workers=1) as executor:
+                land_fraction = executor.submit(give_attached_land_fraction, handle).result()
+            self.assertAlmostEqual(land_fraction, world.give_land_fraction())
+
+        self.assertTrue(shared_world.closed)
+        self.assertFalse(os.path.exists(handle.directory))
+
 
 if __name__ == '__main__':
     unittest.main()
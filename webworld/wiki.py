@@ -1,16 +1,22 @@
 # -*- coding: utf-8 -*-
 """Module containing functionality to create pages on the MediaWiki"""
+import concurrent.futures
 import logging
 import os
+import tempfile
+import threading
 
 import matplotlib.image
+import numpy as np
 import requests
 
 TEMPORARY_IMAGE_PATH = "temporary_image.png"
 LOGGER = logging.getLogger(__name__)
 
 
-def create_page(world):
+def create_page(world, publish_queue=None):
+    """Create the page of a world. With a publish_queue, the page is uploaded in the background and a future for the
+    upload is returned."""
     image_paths = [TEMPORARY_IMAGE_PATH]
     wiki_filenames = ["world.png"]
 
@@ -19,6 +25,10 @@ def create_page(world):
     contents = "This is the world\n\n[[File:{}]]".format(wiki_filenames[0])
 
     color_map = world.give_height_color_map()
+
+    if publish_queue is not None:
+        return publish_queue.publish_page(title, contents, summary=summary, images={wiki_filenames[0]: color_map})
+
     matplotlib.image.imsave(TEMPORARY_IMAGE_PATH, color_map)
     LOGGER.info("Wrote world height map to disk as temporary image")
 
@@ -41,6 +51,65 @@ def send_page(title, contents, summary="", image_paths=None, wiki_filenames=None
     session.close()
 
 
+class PublishQueue(object):
+    """Send pages to the MediaWiki in background threads, so that the caller can continue (e.g. generate the next world)
+    while pages are uploaded.
+
+    At most max_workers pages are uploaded at the same time. When max_pending pages are waiting or being uploaded,
+    publish_page blocks until one is finished, which bounds the memory held by queued images. Each publish_page call
+    returns a concurrent.futures.Future, which raises the upload error (if any) from its result() method. Failures are
+    also logged. Use the queue as a context manager, or call close(), to wait for all uploads to finish.
+    """
+
+    def __init__(self, max_workers=2, max_pending=4):
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+        self._pending = threading.BoundedSemaphore(max_pending)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def publish_page(self, title, contents, summary="", images=None):
+        """Queue a page for sending
+
+        :param images   Dictionary from wiki filename to image array, which are written to disk by the worker
+        :returns        A future for the upload
+        """
+        # Copy the images, as the caller may modify them before the upload
+        images = {wiki_filename: np.array(image) for wiki_filename, image in (images or {}).items()}
+
+        self._pending.acquire()
+        try:
+            future = self._executor.submit(_publish_page, title, contents, summary, images)
+        except Exception:
+            self._pending.release()
+            raise
+
+        future.add_done_callback(lambda finished_future: self._on_done(title, finished_future))
+        return future
+
+    def close(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+    def _on_done(self, title, future):
+        self._pending.release()
+        if not future.cancelled() and future.exception() is not None:
+            LOGGER.error("Failed to publish page {}: {}".format(title, future.exception()))
+
+
+def _publish_page(title, contents, summary, images):
+    with tempfile.TemporaryDirectory() as image_directory:
+        image_paths = []
+        for wiki_filename, image in images.items():
+            image_path = os.path.join(image_directory, wiki_filename)
+            matplotlib.image.imsave(image_path, image)
+            image_paths.append(image_path)
+
+        send_page(title, contents, summary=summary, image_paths=image_paths, wiki_filenames=list(images))
+
+
 def _login(api_url, session):
     username = 'bot'
     password = 'password'  # see https://www.mediawiki.org/wiki/Manual:Bot_passwords
@@ -1,4 +1,9 @@
+import collections
 import enum
+import os
+import shutil
+import tempfile
+import weakref
 
 import matplotlib.pyplot as plt
 import numpy as np
@@ -21,6 +26,8 @@ LAND_COLORS = ((121, 136, 90),
                (165, 72, 19),
                (145, 48, 14))
 
+_BAND_COLORS = np.array(WATER_COLORS + LAND_COLORS, dtype=np.uint8)
+
 
 class Quantity(enum.Enum):
     HEIGHT = 0
@@ -33,6 +40,32 @@ class World(object):
         self.tiles = tiles
         self.water_level = water_level
 
+    @property
+    def tiles(self):
+        # A world attached to shared maps creates its tiles only when they are needed
+        if self._tiles is None and self._shared_maps:
+            make_tile = np.frompyfunc(Tile, 2, 1)
+            self._tiles = make_tile(self._shared_maps[Quantity.HEIGHT], self._shared_maps[Quantity.FOOD])
+
+        return self._tiles
+
+    @tiles.setter
+    def tiles(self, tiles):
+        self._tiles = tiles
+        self._shared_maps = {}
+        self.invalidate_cache()
+
+    def invalidate_cache(self):
+        """Drop all cached maps and analysis results. Assigning new tiles or changing the height or food of a tile does
+        this automatically, call it explicitly after replacing elements of the tiles array."""
+        self._cache_tile_modification_count = Tile._modification_count
+        self._quantity_maps = {}
+        self._analysis_cache = {}
+        self._water_level_cache = {}
+        self._water_level_cache_level = None
+        self._color_map = None
+        self._color_map_band_positions = None
+
     @classmethod
     def from_height_map(cls, height_map, water_level):
 
@@ -47,6 +80,22 @@ class World(object):
 
         return World(tiles, water_level)
 
+    @classmethod
+    def _from_maps(cls, height_map, food_map, water_level):
+
+        world = World(None, water_level)
+        world._shared_maps = {Quantity.HEIGHT: height_map, Quantity.FOOD: food_map}
+        return world
+
+    def export_shared(self, directory=None):
+        """Copy the height and food maps to memory-mapped files, which other processes can attach to without copying.
+
+        :returns    A SharedWorld, which owns the files. Pass its (small, picklable) handle to other processes, and
+                    close it when they are done.
+        """
+
+        return SharedWorld(self, directory=directory)
+
     @staticmethod
     def tiles_from_height_map(height_map):
 
@@ -71,19 +120,134 @@ class World(object):
 
     def give_map(self, quantity):
 
-        quantity_map = np.empty_like(self.tiles, dtype=float)
+        # Maps of an attached world are copied from the shared maps, as long as its tiles are not created
+        if self._tiles is None and quantity in self._shared_maps:
+            return np.array(self._shared_maps[quantity], dtype=float)
+
+        if quantity == Quantity.HEIGHT:
+            attribute = "height"
+        elif quantity == Quantity.FOOD:
+            attribute = "food"
+        else:
+            raise NotImplementedError()
+
+        get_attribute = np.frompyfunc(lambda tile: getattr(tile, attribute), 1, 1)
+        return get_attribute(self.tiles).astype(float)
+
+    def _cached_map(self, quantity):
+        """Return the (shared, not to be modified) map of a quantity, extracting it from the tiles only once"""
+
+        self._validate_cache()
+
+        if self._tiles is None and quantity in self._shared_maps:
+            return self._shared_maps[quantity]
+
+        if quantity not in self._quantity_maps:
+            self._quantity_maps[quantity] = self.give_map(quantity)
+
+        return self._quantity_maps[quantity]
+
+    def _validate_cache(self):
+        if self._cache_tile_modification_count != Tile._modification_count:
+            self.invalidate_cache()
+
+    def _give_water_level(self, water_level):
+        return self.water_level if water_level is None else water_level
+
+    def _cached_analysis(self, key, compute, water_level=None):
+        """Return a cached analysis result. Results that depend on the water level are only kept for the most recently
+        queried water level, so that sweeps over many levels do not accumulate full-size maps."""
+
+        self._validate_cache()
+
+        if water_level is None:
+            cache = self._analysis_cache
+        else:
+            if water_level != self._water_level_cache_level:
+                self._water_level_cache = {}
+                self._water_level_cache_level = water_level
+            cache = self._water_level_cache
 
-        for i_row in range(quantity_map.shape[0]):
-            for i_column in range(quantity_map.shape[1]):
+        if key not in cache:
+            result = compute()
 
-                if quantity == Quantity.HEIGHT:
-                    quantity_map[i_row, i_column] = self.tiles[i_row, i_column].height
-                elif quantity == Quantity.FOOD:
-                    quantity_map[i_row, i_column] = self.tiles[i_row, i_column].food
-                else:
-                    raise NotImplementedError()
+            # Results are shared between callers, so protect them against modification
+            for array in (result if isinstance(result, tuple) else (result,)):
+                if isinstance(array, np.ndarray):
+                    array.flags.writeable = False
 
-        return quantity_map
+            cache[key] = result
+
+        return cache[key]
+
+    def give_height_histogram(self, bins=10):
+        """Histogram of the tile heights, as returned by np.histogram
+
+        :returns    The counts per bin
+                    The bin edges
+        """
+
+        height_map = self._cached_map(Quantity.HEIGHT)
+        key = ("height_histogram", tuple(np.atleast_1d(bins)))
+        return self._cached_analysis(key, lambda: np.histogram(height_map, bins=bins))
+
+    def give_water_mask(self, water_level=None):
+        """Boolean map that is True for tiles below the water level. Tiles exactly at the water level count as land,
+        consistent with the colors of give_height_color_map."""
+
+        water_level = self._give_water_level(water_level)
+        height_map = self._cached_map(Quantity.HEIGHT)
+        return self._cached_analysis("water_mask", lambda: height_map < water_level, water_level)
+
+    def give_height_index(self):
+        """Index of the tiles sorted on height, computed once per set of tiles
+
+        :returns    The flat tile indices in order of increasing height
+                    The heights in that order
+        """
+
+        def compute():
+            flat_height_map = self._cached_map(Quantity.HEIGHT).ravel()
+            order = np.argsort(flat_height_map)
+            return order, flat_height_map[order]
+
+        return self._cached_analysis("height_index", compute)
+
+    def give_water_fraction(self, water_level=None):
+        # Binary search in the sorted heights, so any water level is answered in O(log n)
+        water_level = self._give_water_level(water_level)
+        _, sorted_heights = self.give_height_index()
+        return np.searchsorted(sorted_heights, water_level, side="left") / len(sorted_heights)
+
+    def give_land_fraction(self, water_level=None):
+        return 1 - self.give_water_fraction(water_level)
+
+    def give_land_masses(self, water_level=None):
+        """Label the connected land masses (4-connectivity) at a water level
+
+        :returns    Map with 0 for water and labels 1, ..., n for the land masses
+                    The number of land masses n
+        """
+
+        water_level = self._give_water_level(water_level)
+        water_mask = self.give_water_mask(water_level)
+        return self._cached_analysis("land_masses", lambda: _label_regions(~water_mask), water_level)
+
+    def give_coastline_mask(self, water_level=None):
+        """Boolean map that is True for land tiles that have a water tile as a direct (4-connected) neighbor"""
+
+        water_level = self._give_water_level(water_level)
+        water_mask = self.give_water_mask(water_level)
+
+        def compute():
+            water_neighbor = np.zeros_like(water_mask)
+            water_neighbor[1:, :] |= water_mask[:-1, :]
+            water_neighbor[:-1, :] |= water_mask[1:, :]
+            water_neighbor[:, 1:] |= water_mask[:, :-1]
+            water_neighbor[:, :-1] |= water_mask[:, 1:]
+            return water_neighbor & ~water_mask
+
+        return self._cached_analysis("coastline_mask", compute, water_level)
 
     def visualize_height_map(self):
 
@@ -95,38 +259,195 @@ class World(object):
         plt.show()
 
     def give_height_color_map(self):
+        """Color the tiles in bands of equal height range, between the lowest tile and the water level for water and
+        between the water level and the highest tile for land.
+
+        The color map is kept between calls. After a change of water_level only the tiles that move to another color
+        band are recolored, which are found as ranges in the height index. A copy is returned.
+        """
 
-        height_map = self.give_map(Quantity.HEIGHT)
+        order, sorted_heights = self.give_height_index()
 
-        assert np.amin(height_map) < self.water_level
-        assert self.water_level < np.amax(height_map)
+        assert sorted_heights[0] < self.water_level
+        assert self.water_level < sorted_heights[-1]
 
-        color_map = np.zeros((*height_map.shape, 3)).astype(np.uint8)
+        band_positions = self._give_band_positions()
 
-        water_color_boundaries = np.linspace(np.amin(height_map), self.water_level, len(WATER_COLORS) + 1)
-        for i_color in range(len(WATER_COLORS)):
-            color = WATER_COLORS[i_color]
-            start_height = water_color_boundaries[i_color]
-            end_height = water_color_boundaries[i_color + 1]
-            indices = np.logical_and(start_height <= height_map, height_map <= end_height)
-            color_map[indices] = color
+        if self._color_map is None:
+            self._color_map = np.empty((*self._cached_map(Quantity.HEIGHT).shape, 3), dtype=np.uint8)
+            band_sizes = np.diff(np.concatenate(([0], band_positions, [len(order)])))
+            bands = np.repeat(np.arange(len(_BAND_COLORS)), band_sizes)
+            self._color_map.reshape(-1, 3)[order] = _BAND_COLORS[bands]
 
-        land_color_boundaries = np.linspace(self.water_level, np.amax(height_map), len(LAND_COLORS) + 1)
-        for i_color in range(len(LAND_COLORS)):
-            color = LAND_COLORS[i_color]
-            start_height = land_color_boundaries[i_color]
-            end_height = land_color_boundaries[i_color + 1]
-            indices = np.logical_and(start_height <= height_map, height_map <= end_height)
-            color_map[indices] = color
+        elif not np.array_equal(band_positions, self._color_map_band_positions):
+            flat_color_map = self._color_map.reshape(-1, 3)
 
-        return color_map
+            # Between consecutive old and new band boundaries the old and new band are constant, so each such range of
+            # the height index either keeps its color or is recolored as a whole
+            range_boundaries = np.union1d(np.concatenate((self._color_map_band_positions, band_positions)),
+                                          [0, len(order)])
+            range_starts = range_boundaries[:-1]
+            range_ends = range_boundaries[1:]
+            old_bands = np.searchsorted(self._color_map_band_positions, range_starts, side="right")
+            new_bands = np.searchsorted(band_positions, range_starts, side="right")
+
+            for start, end, old_band, new_band in zip(range_starts, range_ends, old_bands, new_bands):
+                if old_band != new_band:
+                    flat_color_map[order[start:end]] = _BAND_COLORS[new_band]
+
+        self._color_map_band_positions = band_positions
+
+        return self._color_map.copy()
+
+    def _give_band_positions(self):
+        """Positions in the height index where the color bands for the current water level start, the first band
+        excluded. A tile exactly at a boundary belongs to the upper band, and the highest tile to the last band."""
+
+        _, sorted_heights = self.give_height_index()
+
+        water_color_boundaries = np.linspace(sorted_heights[0], self.water_level, len(WATER_COLORS) + 1)
+        land_color_boundaries = np.linspace(self.water_level, sorted_heights[-1], len(LAND_COLORS) + 1)
+        inner_boundaries = np.concatenate((water_color_boundaries[1:], land_color_boundaries[1:-1]))
+
+        return np.searchsorted(sorted_heights, inner_boundaries, side="left")
+
+
+class SharedWorld(object):
+    """The height and food maps of a world in memory-mapped .npy files, by default in /dev/shm (when available) so that
+    they live in shared memory.
+
+    The files are removed by close(), on leaving the with block, or at the latest when this object is garbage collected.
+    Worlds attached to the handle remain valid after closing on POSIX systems, but no new worlds can be attached.
+    """
+
+    def __init__(self, world, directory=None):
+        if directory is None and os.path.isdir("/dev/shm"):
+            directory = "/dev/shm"
+
+        self._directory = tempfile.mkdtemp(prefix="webworld_", dir=directory)
+        self._finalizer = weakref.finalize(self, shutil.rmtree, self._directory, ignore_errors=True)
+
+        for quantity in Quantity:
+            np.save(_shared_map_path(self._directory, quantity), world._cached_map(quantity))
+
+        self.handle = WorldHandle(self._directory, world.water_level)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def closed(self):
+        return not self._finalizer.alive
+
+    def close(self):
+        self._finalizer()
+
+
+class WorldHandle(collections.namedtuple("WorldHandle", ["directory", "water_level"])):
+    """Picklable reference to a SharedWorld"""
+
+    __slots__ = ()
+
+    def attach(self):
+        """Create a World with read-only maps that are mapped from the shared files instead of copied"""
+
+        height_map = np.load(_shared_map_path(self.directory, Quantity.HEIGHT), mmap_mode="r")
+        food_map = np.load(_shared_map_path(self.directory, Quantity.FOOD), mmap_mode="r")
+        return World._from_maps(height_map, food_map, self.water_level)
+
+
+def _shared_map_path(directory, quantity):
+    return os.path.join(directory, "{}.npy".format(quantity.name.lower()))
+
+
+def _label_regions(mask):
+    """Label the 4-connected regions of True values in a 2D boolean mask.
+
+    The mask is split in horizontal runs of True values. Runs in adjacent rows that overlap are connected, and the
+    runs are merged into regions by hooking the roots of connected runs onto each other. All steps are vectorized, and
+    the number of runs is typically far smaller than the number of tiles.
+
+    :returns    Map with 0 outside the mask and labels 1, ..., n for the regions
+                The number of regions n
+    """
+
+    labels = np.zeros(mask.shape, dtype=int)
+    if not np.any(mask):
+        return labels, 0
+
+    # Find the runs, padding each row with a False value so that runs end at the row boundary
+    row_length = mask.shape[1] + 1
+    padded_mask = np.zeros((mask.shape[0], row_length), dtype=np.int8)
+    padded_mask[:, :-1] = mask
+    changes = np.diff(np.concatenate(([0], padded_mask.ravel())))
+    run_starts = np.flatnonzero(changes == 1)
+    run_ends = np.flatnonzero(changes == -1)
+
+    # Runs are sorted on row and column, so for each run the overlapping runs in the previous row form a contiguous
+    # range, which is found by shifting its columns one row up and searching
+    lower_indices = np.searchsorted(run_ends, run_starts - row_length, side="right")
+    upper_indices = np.searchsorted(run_starts, run_ends - row_length, side="left")
+    overlap_counts = np.maximum(upper_indices - lower_indices, 0)
+
+    runs_below = np.repeat(np.arange(len(run_starts)), overlap_counts)
+    runs_above = np.repeat(lower_indices - np.cumsum(overlap_counts) + overlap_counts, overlap_counts) + \
+        np.arange(np.sum(overlap_counts))
+
+    # Each run points to a run of its region with a smaller or equal index, and runs pointing to themselves are roots.
+    # Connected runs with different roots get the larger root hooked onto the smaller one, after which pointer jumping
+    # lets every run point to its root again. Whole trees are merged per round, so few rounds are needed.
+    run_labels = np.arange(len(run_starts))
+    while True:
+        roots_above = run_labels[runs_above]
+        roots_below = run_labels[runs_below]
+        if np.array_equal(roots_above, roots_below):
+            break
+
+        np.minimum.at(run_labels, roots_above, roots_below)
+        np.minimum.at(run_labels, roots_below, roots_above)
+
+        while True:
+            jumped_labels = run_labels[run_labels]
+            if np.array_equal(jumped_labels, run_labels):
+                break
+            run_labels = jumped_labels
+
+    unique_labels, run_labels = np.unique(run_labels, return_inverse=True)
+    labels[mask] = np.repeat(run_labels + 1, run_ends - run_starts)
+
+    return labels, len(unique_labels)
 
 
 class Tile(object):
 
+    # Counts the changes of height and food over all tiles, so that worlds can detect that their cached maps are
+    # outdated
+    _modification_count = 0
+
     def __init__(self, height, food):
-        self.height = height
-        self.food = food
+        self._height = height
+        self._food = food
+
+    @property
+    def height(self):
+        return self._height
+
+    @height.setter
+    def height(self, height):
+        self._height = height
+        Tile._modification_count += 1
+
+    @property
+    def food(self):
+        return self._food
+
+    @food.setter
+    def food(self, food):
+        self._food = food
+        Tile._modification_count += 1
 
 
 def main():